@@ -20,7 +20,9 @@
 
 from __future__ import absolute_import
 
+import concurrent.futures
 import logging
+import threading
 import unittest
 from builtins import object
 
@@ -39,8 +41,10 @@ from apache_beam.io.gcp.pubsub import _PubSubSink
 from apache_beam.io.gcp.pubsub import _PubSubSource
 from apache_beam.options.pipeline_options import PipelineOptions
 from apache_beam.options.pipeline_options import StandardOptions
+from apache_beam.runners.direct import direct_runner
 from apache_beam.runners.direct import transform_evaluator
 from apache_beam.runners.direct.direct_runner import _DirectReadFromPubSub
+from apache_beam.runners.direct.direct_runner import _DirectWriteToPubSubFn
 from apache_beam.runners.direct.direct_runner import _get_transform_overrides
 from apache_beam.runners.direct.transform_evaluator import _PubSubReadEvaluator
 from apache_beam.testing import test_utils
@@ -546,10 +550,49 @@ class TestReadFromPubSub(unittest.TestCase):
       p.run()
 
 
+def _completed_publish_future(*unused_args, **unused_kwargs):
+  publish_future = concurrent.futures.Future()
+  publish_future.set_result('message_id')
+  return publish_future
+
+
+def _failed_publish_future(*unused_args, **unused_kwargs):
+  publish_future = concurrent.futures.Future()
+  publish_future.set_exception(RuntimeError('publish failed'))
+  return publish_future
+
+
+class _ResultOnlyPublishFuture(object):
+  """A publish future that is not a concurrent.futures.Future.
+
+  Like the futures of google-cloud-pubsub < 1.1, it cannot be passed to
+  concurrent.futures.wait(). It completes asynchronously, from another thread,
+  unless it is created with complete=False.
+  """
+
+  def __init__(self, result=None, exception=None, complete=True):
+    self._result = result
+    self._exception = exception
+    self._completed = threading.Event()
+    if complete:
+      threading.Timer(0.01, self._completed.set).start()
+
+  def result(self, timeout=None):
+    if not self._completed.wait(timeout):
+      raise concurrent.futures.TimeoutError()
+    if self._exception is not None:
+      raise self._exception
+    return self._result
+
+
 @unittest.skipIf(pubsub is None, 'GCP dependencies are not installed')
 @mock.patch('google.cloud.pubsub.PublisherClient')
 class TestWriteToPubSub(unittest.TestCase):
 
+  def setUp(self):
+    # Make sure each test gets a client created from its own mock.
+    direct_runner._PUBLISHER_CLIENTS.clear()
+
   def test_write_messages_success(self, mock_pubsub):
     data = 'data'
     payloads = [data]
@@ -565,6 +608,91 @@ class TestWriteToPubSub(unittest.TestCase):
     mock_pubsub.return_value.publish.assert_has_calls([
         mock.call(mock.ANY, data)])
 
+  def test_write_messages_buffer_size(self, mock_pubsub):
+    payloads = ['data1', 'data2', 'data3']
+    mock_pubsub.return_value.publish.side_effect = _completed_publish_future
+
+    options = PipelineOptions(['--direct_runner_pubsub_write_buffer_size=2'])
+    options.view_as(StandardOptions).streaming = True
+    p = TestPipeline(options=options)
+    _ = (p
+         | Create(payloads)
+         | WriteToPubSub('projects/fakeprj/topics/a_topic',
+                         with_attributes=False))
+    p.run()
+    _, kwargs = mock_pubsub.call_args
+    self.assertEqual(2, kwargs['batch_settings'].max_messages)
+    mock_pubsub.return_value.publish.assert_has_calls(
+        [mock.call(mock.ANY, data) for data in payloads], any_order=True)
+
+  def test_write_fn_flushes_at_buffer_size(self, mock_pubsub):
+    publish = mock_pubsub.return_value.publish
+    publish.side_effect = _completed_publish_future
+    sink = _PubSubSink('projects/fakeprj/topics/a_topic', id_label=None,
+                       with_attributes=False, timestamp_attribute=None)
+    fn = _DirectWriteToPubSubFn(sink, buffer_size=2)
+
+    fn.start_bundle()
+    fn.process('data1')
+    self.assertEqual(0, publish.call_count)
+    fn.process('data2')
+    self.assertEqual(2, publish.call_count)
+    fn.process('data3')
+    self.assertEqual(2, publish.call_count)
+    fn.finish_bundle()
+    publish.assert_has_calls([mock.call(mock.ANY, 'data1'),
+                              mock.call(mock.ANY, 'data2'),
+                              mock.call(mock.ANY, 'data3')])
+
+  def test_write_messages_in_flight_limit(self, mock_pubsub):
+    payloads = ['data%d' % i for i in range(5)]
+    mock_pubsub.return_value.publish.side_effect = _completed_publish_future
+
+    options = PipelineOptions([])
+    options.view_as(StandardOptions).streaming = True
+    p = TestPipeline(options=options)
+    _ = (p
+         | Create(payloads)
+         | WriteToPubSub('projects/fakeprj/topics/a_topic',
+                         with_attributes=False))
+    with mock.patch.object(_DirectWriteToPubSubFn, 'MAX_IN_FLIGHT_MESSAGES', 1):
+      p.run()
+    mock_pubsub.return_value.publish.assert_has_calls(
+        [mock.call(mock.ANY, data) for data in payloads], any_order=True)
+    self.assertEqual(len(payloads),
+                     mock_pubsub.return_value.publish.call_count)
+
+  def test_write_fn_in_flight_limit_timeout(self, mock_pubsub):
+    # The publishes never complete.
+    mock_pubsub.return_value.publish.side_effect = (
+        lambda *unused_args, **unused_kwargs: concurrent.futures.Future())
+    sink = _PubSubSink('projects/fakeprj/topics/a_topic', id_label=None,
+                       with_attributes=False, timestamp_attribute=None)
+    fn = _DirectWriteToPubSubFn(sink, buffer_size=2)
+    fn.flush_timeout_secs = 0.01
+
+    with mock.patch.object(_DirectWriteToPubSubFn, 'MAX_IN_FLIGHT_MESSAGES', 1):
+      fn.start_bundle()
+      fn.process('data1')
+      with self.assertRaises(concurrent.futures.TimeoutError):
+        fn.process('data2')
+    self.assertEqual(1, mock_pubsub.return_value.publish.call_count)
+
+  def test_write_fn_result_only_future_timeout(self, mock_pubsub):
+    # The publishes never complete.
+    mock_pubsub.return_value.publish.side_effect = (
+        lambda *unused_args, **unused_kwargs: _ResultOnlyPublishFuture(
+            complete=False))
+    sink = _PubSubSink('projects/fakeprj/topics/a_topic', id_label=None,
+                       with_attributes=False, timestamp_attribute=None)
+    fn = _DirectWriteToPubSubFn(sink, buffer_size=2)
+    fn.flush_timeout_secs = 0.01
+
+    fn.start_bundle()
+    fn.process('data1')
+    with self.assertRaises(concurrent.futures.TimeoutError):
+      fn.process('data2')
+
   def test_write_messages_deprecated(self, mock_pubsub):
     data = 'data'
     payloads = [data]
@@ -595,6 +723,56 @@ class TestWriteToPubSub(unittest.TestCase):
     mock_pubsub.return_value.publish.assert_has_calls([
         mock.call(mock.ANY, data, **attributes)])
 
+  def test_write_messages_publish_error(self, mock_pubsub):
+    data = 'data'
+    payloads = [data]
+    mock_pubsub.return_value.publish.side_effect = _failed_publish_future
+
+    options = PipelineOptions([])
+    options.view_as(StandardOptions).streaming = True
+    p = TestPipeline(options=options)
+    _ = (p
+         | Create(payloads)
+         | WriteToPubSub('projects/fakeprj/topics/a_topic',
+                         with_attributes=False))
+    with self.assertRaisesRegex(RuntimeError, r'publish failed'):
+      p.run()
+
+  def test_write_messages_result_only_future_success(self, mock_pubsub):
+    data = 'data'
+    payloads = [data]
+    mock_pubsub.return_value.publish.side_effect = (
+        lambda *unused_args, **unused_kwargs: _ResultOnlyPublishFuture(
+            result='message_id'))
+
+    options = PipelineOptions([])
+    options.view_as(StandardOptions).streaming = True
+    p = TestPipeline(options=options)
+    _ = (p
+         | Create(payloads)
+         | WriteToPubSub('projects/fakeprj/topics/a_topic',
+                         with_attributes=False))
+    p.run()
+    mock_pubsub.return_value.publish.assert_has_calls([
+        mock.call(mock.ANY, data)])
+
+  def test_write_messages_result_only_future_error(self, mock_pubsub):
+    data = 'data'
+    payloads = [data]
+    mock_pubsub.return_value.publish.side_effect = (
+        lambda *unused_args, **unused_kwargs: _ResultOnlyPublishFuture(
+            exception=RuntimeError('publish failed')))
+
+    options = PipelineOptions([])
+    options.view_as(StandardOptions).streaming = True
+    p = TestPipeline(options=options)
+    _ = (p
+         | Create(payloads)
+         | WriteToPubSub('projects/fakeprj/topics/a_topic',
+                         with_attributes=False))
+    with self.assertRaisesRegex(RuntimeError, r'publish failed'):
+      p.run()
+
   def test_write_messages_with_attributes_error(self, mock_pubsub):
     data = 'data'
     # Sending raw data when WriteToPubSub expects a PubsubMessage object.
@@ -397,6 +397,8 @@ class TypeOptions(PipelineOptions):
 class DirectOptions(PipelineOptions):
   """DirectRunner-specific execution options."""
 
+  DEFAULT_PUBSUB_WRITE_BUFFER_SIZE = 1000
+
   @classmethod
   def _add_argparse_args(cls, parser):
     parser.add_argument(
@@ -417,6 +419,20 @@ class DirectOptions(PipelineOptions):
         type=int,
         default=1,
         help='number of parallel running workers.')
+    parser.add_argument(
+        '--direct_runner_pubsub_write_buffer_size',
+        type=int,
+        default=cls.DEFAULT_PUBSUB_WRITE_BUFFER_SIZE,
+        help='number of elements buffered by the DirectRunner before they '
+        'are published to PubSub by WriteToPubSub. Publishing a full buffer '
+        'times out after 0.5 seconds per element, and at most after 50 '
+        'seconds.')
+
+  def validate(self, validator):
+    errors = []
+    errors.extend(validator.validate_optional_argument_positive(
+        self, 'direct_runner_pubsub_write_buffer_size'))
+    return errors
 
 
 class GoogleCloudOptions(PipelineOptions):
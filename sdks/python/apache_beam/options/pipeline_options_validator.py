@@ -28,6 +28,7 @@ from past.builtins import unicode
 
 from apache_beam.internal import pickler
 from apache_beam.options.pipeline_options import DebugOptions
+from apache_beam.options.pipeline_options import DirectOptions
 from apache_beam.options.pipeline_options import GoogleCloudOptions
 from apache_beam.options.pipeline_options import SetupOptions
 from apache_beam.options.pipeline_options import StandardOptions
@@ -48,8 +49,8 @@ class PipelineOptionsValidator(object):
   """
 
   # Validator will call validate on these subclasses of PipelineOptions
-  OPTIONS = [DebugOptions, GoogleCloudOptions, SetupOptions, StandardOptions,
-             TypeOptions, WorkerOptions, TestOptions]
+  OPTIONS = [DebugOptions, DirectOptions, GoogleCloudOptions, SetupOptions,
+             StandardOptions, TypeOptions, WorkerOptions, TestOptions]
 
   # Possible validation errors.
   ERR_MISSING_OPTION = 'Missing required option: %s.'
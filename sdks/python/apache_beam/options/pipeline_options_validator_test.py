@@ -230,6 +230,30 @@ class SetupTest(unittest.TestCase):
       self.assertEqual(
           self.check_errors_for_arguments(errors, case['errors']), [])
 
+  def test_direct_runner_pubsub_write_buffer_size(self):
+    def get_validator(buffer_size):
+      options = []
+      if buffer_size is not None:
+        options.append('--direct_runner_pubsub_write_buffer_size=' +
+                       buffer_size)
+      pipeline_options = PipelineOptions(options)
+      runner = MockRunners.OtherRunner()
+      return PipelineOptionsValidator(pipeline_options, runner)
+
+    test_cases = [
+        {'buffer_size': None, 'errors': []},
+        {'buffer_size': '1', 'errors': []},
+        {'buffer_size': '0',
+         'errors': ['direct_runner_pubsub_write_buffer_size']},
+        {'buffer_size': '-1',
+         'errors': ['direct_runner_pubsub_write_buffer_size']},
+    ]
+
+    for case in test_cases:
+      errors = get_validator(case['buffer_size']).validate()
+      self.assertEqual(
+          self.check_errors_for_arguments(errors, case['errors']), [])
+
   def test_is_service_runner(self):
     test_cases = [
         {
@@ -23,10 +23,13 @@ graph of transformations belonging to a pipeline on the local machine.
 
 from __future__ import absolute_import
 
-import itertools
+import collections
+import concurrent.futures
 import logging
+import threading
 import time
 import typing
+import weakref
 
 from google.protobuf import wrappers_pb2
 
@@ -62,6 +65,125 @@ __all__ = ['BundleBasedDirectRunner',
 
 _LOGGER = logging.getLogger(__name__)
 
+# Objects imported on first use by _lazy(), as importing them when this module
+# is loaded would create a circular dependency.
+_LAZY = {}
+
+# Whether grpc is importable; memoized on the first call to _has_grpc().
+_HAS_GRPC = None
+
+# Whether the PubSub I/O is importable; memoized on the first call to
+# _pubsub_available().
+_PUBSUB_AVAILABLE = None
+
+# Map from transform type to the functions checking whether the FnApiRunner
+# supports a transform of that type; see _get_fnapi_checks(). Weakly keyed, so
+# that transform classes that are no longer used can be collected.
+_FNAPI_CHECKS = weakref.WeakKeyDictionary()
+
+# PublisherClients shared by the DirectRunner's PubSub writes, keyed by batch
+# settings from least to most recently created; see _get_publisher_client().
+_PUBLISHER_CLIENTS = collections.OrderedDict()
+_MAX_PUBLISHER_CLIENTS = 8
+_PUBLISHER_CLIENTS_LOCK = threading.Lock()
+
+# Map from the options the DirectRunner's PTransformOverrides depend on to the
+# list of overrides; see _get_transform_overrides().
+_TRANSFORM_OVERRIDES_CACHE = {}
+
+
+def _lazy(name, importer):
+  """Returns the object cached under the given name.
+
+  The object is obtained by calling importer() the first time it is requested.
+  This is used for objects that cannot be imported when this module is loaded,
+  and are needed for every transform of a pipeline. Concurrent first calls may
+  both call importer(), which is harmless as importing is idempotent.
+  """
+  value = _LAZY.get(name)
+  if value is None:
+    value = _LAZY[name] = importer()
+  return value
+
+
+def _import_native_source():
+  from apache_beam.runners.dataflow.native_io.iobase import NativeSource
+  return NativeSource
+
+
+def _has_grpc():
+  global _HAS_GRPC  # pylint: disable=global-statement
+  if _HAS_GRPC is None:
+    try:
+      # pylint: disable=unused-import
+      import grpc
+      _HAS_GRPC = True
+    except ImportError:
+      _HAS_GRPC = False
+  return _HAS_GRPC
+
+
+class _AbortPipelineVisit(Exception):
+  """Raised by a PipelineVisitor to stop the traversal of a Pipeline."""
+
+
+def _reject_test_stream(visitor, unused_transform):
+  # The FnApiRunner does not support streaming execution.
+  visitor.supported_by_fnapi_runner = False
+
+
+def _check_read(visitor, transform):
+  # The FnApiRunner does not support reads from NativeSources.
+  if isinstance(transform.source, _lazy('NativeSource', _import_native_source)):
+    visitor.supported_by_fnapi_runner = False
+
+
+def _reject_native_write(visitor, unused_transform):
+  # The FnApiRunner does not support the use of _NativeWrites.
+  visitor.supported_by_fnapi_runner = False
+
+
+def _check_pardo(visitor, transform):
+  dofn = transform.dofn
+  # The FnApiRunner does not support execution of CombineFns with
+  # deferred side inputs.
+  if isinstance(dofn, CombineValuesDoFn):
+    args, kwargs = transform.raw_side_inputs
+    for arg in args:
+      if isinstance(arg, ArgumentPlaceholder):
+        visitor.supported_by_fnapi_runner = False
+        return
+    for arg in kwargs.values():
+      if isinstance(arg, ArgumentPlaceholder):
+        visitor.supported_by_fnapi_runner = False
+        return
+
+
+def _create_fnapi_check_bases():
+  # Importing following locally to avoid a circular dependency.
+  from apache_beam.runners.dataflow.native_io.iobase import _NativeWrite
+  from apache_beam.testing.test_stream import _TestStream
+  return ((_TestStream, _reject_test_stream),
+          (beam.io.Read, _check_read),
+          (_NativeWrite, _reject_native_write),
+          (beam.ParDo, _check_pardo))
+
+
+def _get_fnapi_checks(transform_type):
+  """Returns the FnApiRunner support checks for the given transform type.
+
+  The checks of all bases the type is a subclass of are resolved with
+  issubclass() the first time a transform type is seen, and then recorded in
+  _FNAPI_CHECKS.
+  """
+  checks = _FNAPI_CHECKS.get(transform_type)
+  if checks is None:
+    checks = _FNAPI_CHECKS[transform_type] = tuple(
+        check for base, check in _lazy('fnapi_check_bases',
+                                       _create_fnapi_check_bases)
+        if issubclass(transform_type, base))
+  return checks
+
 
 class SwitchingDirectRunner(PipelineRunner):
   """Executes a single pipeline on the local machine.
@@ -78,53 +200,37 @@ class SwitchingDirectRunner(PipelineRunner):
   def run_pipeline(self, pipeline, options):
 
     from apache_beam.pipeline import PipelineVisitor
-    from apache_beam.runners.dataflow.native_io.iobase import NativeSource
-    from apache_beam.runners.dataflow.native_io.iobase import _NativeWrite
-    from apache_beam.testing.test_stream import _TestStream
 
     class _FnApiRunnerSupportVisitor(PipelineVisitor):
-      """Visitor determining if a Pipeline can be run on the FnApiRunner."""
+      """Visitor determining if a Pipeline can be run on the FnApiRunner.
 
-      def accept(self, pipeline):
+      The traversal is stopped at the first unsupported transform.
+      """
+
+      def __init__(self):
         self.supported_by_fnapi_runner = True
-        pipeline.visit(self)
-        return self.supported_by_fnapi_runner
+
+      def accept(self, pipeline):
+        try:
+          pipeline.visit(self)
+        except _AbortPipelineVisit:
+          pass
+        return self
 
       def visit_transform(self, applied_ptransform):
         transform = applied_ptransform.transform
-        # The FnApiRunner does not support streaming execution.
-        if isinstance(transform, _TestStream):
-          self.supported_by_fnapi_runner = False
-        # The FnApiRunner does not support reads from NativeSources.
-        if (isinstance(transform, beam.io.Read) and
-            isinstance(transform.source, NativeSource)):
-          self.supported_by_fnapi_runner = False
-        # The FnApiRunner does not support the use of _NativeWrites.
-        if isinstance(transform, _NativeWrite):
-          self.supported_by_fnapi_runner = False
-        if isinstance(transform, beam.ParDo):
-          dofn = transform.dofn
-          # The FnApiRunner does not support execution of CombineFns with
-          # deferred side inputs.
-          if isinstance(dofn, CombineValuesDoFn):
-            args, kwargs = transform.raw_side_inputs
-            args_to_check = itertools.chain(args,
-                                            kwargs.values())
-            if any(isinstance(arg, ArgumentPlaceholder)
-                   for arg in args_to_check):
-              self.supported_by_fnapi_runner = False
+        for check in _get_fnapi_checks(type(transform)):
+          check(self, transform)
+        if not self.supported_by_fnapi_runner:
+          raise _AbortPipelineVisit()
 
     # Check whether all transforms used in the pipeline are supported by the
     # FnApiRunner, and the pipeline was not meant to be run as streaming.
-    use_fnapi_runner = (
-        _FnApiRunnerSupportVisitor().accept(pipeline))
+    support_visitor = _FnApiRunnerSupportVisitor().accept(pipeline)
 
     # Also ensure grpc is available.
-    try:
-      # pylint: disable=unused-import
-      import grpc
-    except ImportError:
-      use_fnapi_runner = False
+    use_fnapi_runner = (
+        support_visitor.supported_by_fnapi_runner and _has_grpc())
 
     if use_fnapi_runner:
       from apache_beam.runners.portability.fn_api_runner import FnApiRunner
@@ -174,6 +280,17 @@ class _StreamingGroupAlsoByWindow(_GroupAlsoByWindow):
         context.windowing_strategies.get_by_id(payload.value))
 
 
+def _pubsub_available():
+  global _PUBSUB_AVAILABLE  # pylint: disable=global-statement
+  if _PUBSUB_AVAILABLE is None:
+    try:
+      from apache_beam.io.gcp import pubsub as unused_pubsub
+      _PUBSUB_AVAILABLE = True
+    except ImportError:
+      _PUBSUB_AVAILABLE = False
+  return _PUBSUB_AVAILABLE
+
+
 def _get_transform_overrides(pipeline_options):
   # A list of PTransformOverride objects to be applied before running a pipeline
   # using DirectRunner.
@@ -181,6 +298,21 @@ def _get_transform_overrides(pipeline_options):
   # not change.
   # For internal use only; no backwards-compatibility guarantees.
 
+  # The overrides are created from the values below only, so they are created
+  # once per distinct combination of them. The returned list is shared and
+  # must not be modified.
+  key = (pipeline_options.view_as(StandardOptions).streaming,
+         _pubsub_available(),
+         pipeline_options.view_as(
+             DirectOptions).direct_runner_pubsub_write_buffer_size)
+  overrides = _TRANSFORM_OVERRIDES_CACHE.get(key)
+  if overrides is None:
+    overrides = _TRANSFORM_OVERRIDES_CACHE.setdefault(
+        key, _create_transform_overrides(*key))
+  return overrides
+
+
+def _create_transform_overrides(streaming, pubsub_available, buffer_size):
   # Importing following locally to avoid a circular dependency.
   from apache_beam.pipeline import PTransformOverride
   from apache_beam.runners.direct.helper_transforms import LiftedCombinePerKey
@@ -190,6 +322,8 @@ def _get_transform_overrides(pipeline_options):
   class CombinePerKeyOverride(PTransformOverride):
     def matches(self, applied_ptransform):
       if isinstance(applied_ptransform.transform, CombinePerKey):
+        # Both PCollection.windowing and Windowing.is_default() are memoized,
+        # so this is cheap to evaluate for every CombinePerKey.
         return applied_ptransform.inputs[0].windowing.is_default()
 
     def get_replacement_transform(self, transform):
@@ -230,16 +364,13 @@ def _get_transform_overrides(pipeline_options):
                CombinePerKeyOverride()]
 
   # Add streaming overrides, if necessary.
-  if pipeline_options.view_as(StandardOptions).streaming:
+  if streaming:
     overrides.append(StreamingGroupByKeyOverride())
     overrides.append(StreamingGroupAlsoByWindowOverride())
 
   # Add PubSub overrides, if PubSub is available.
-  try:
-    from apache_beam.io.gcp import pubsub as unused_pubsub
-    overrides += _get_pubsub_transform_overrides(pipeline_options)
-  except ImportError:
-    pass
+  if pubsub_available:
+    overrides += _get_pubsub_transform_overrides(streaming, buffer_size)
 
   return overrides
 
@@ -260,16 +391,54 @@ class _DirectReadFromPubSub(PTransform):
     return PCollection(self.pipeline, is_bounded=self._source.is_bounded())
 
 
-class _DirectWriteToPubSubFn(DoFn):
-  BUFFER_SIZE_ELEMENTS = 100
-  FLUSH_TIMEOUT_SECS = BUFFER_SIZE_ELEMENTS * 0.5
+def _get_publisher_client(max_messages, max_bytes, max_latency):
+  """Returns a PublisherClient with the given batch settings.
+
+  Clients are created once per distinct batch settings and shared by all
+  _DirectWriteToPubSubFn instances of the process, so that the DirectRunner's
+  worker threads reuse the same gRPC channels. At most _MAX_PUBLISHER_CLIENTS
+  clients are cached, the oldest being dropped first. Dropping a client from
+  the cache is safe: writers still using it hold their own reference, and it
+  is released once they are done with it.
+  """
+  key = (max_messages, max_bytes, max_latency)
+  with _PUBLISHER_CLIENTS_LOCK:
+    pub_client = _PUBLISHER_CLIENTS.get(key)
+    if pub_client is None:
+      from google.cloud import pubsub
+      pub_client = _PUBLISHER_CLIENTS[key] = pubsub.PublisherClient(
+          batch_settings=pubsub.types.BatchSettings(
+              max_bytes=max_bytes,
+              max_latency=max_latency,
+              max_messages=max_messages))
+      while len(_PUBLISHER_CLIENTS) > _MAX_PUBLISHER_CLIENTS:
+        _PUBLISHER_CLIENTS.popitem(last=False)
+  return pub_client
 
-  def __init__(self, sink):
+
+class _DirectWriteToPubSubFn(DoFn):
+  BUFFER_SIZE_ELEMENTS = DirectOptions.DEFAULT_PUBSUB_WRITE_BUFFER_SIZE
+  FLUSH_TIMEOUT_SECS_PER_ELEMENT = 0.5
+  MAX_FLUSH_TIMEOUT_SECS = 50
+  # Batching settings for the PublisherClient, so that a full buffer is sent
+  # in as few publish requests as possible. PubSub accepts at most 1000
+  # messages per publish request.
+  MAX_BATCH_MESSAGES = 1000
+  MAX_BATCH_BYTES = 1 << 20
+  MAX_BATCH_LATENCY_SECS = 0.01
+  # Maximum number of messages of a flush that are being published at once.
+  MAX_IN_FLIGHT_MESSAGES = 1000
+
+  def __init__(self, sink, buffer_size=BUFFER_SIZE_ELEMENTS):
     self.project = sink.project
     self.short_topic_name = sink.topic_name
     self.id_label = sink.id_label
     self.timestamp_attribute = sink.timestamp_attribute
     self.with_attributes = sink.with_attributes
+    self.buffer_size = buffer_size
+    self.flush_timeout_secs = min(
+        buffer_size * self.FLUSH_TIMEOUT_SECS_PER_ELEMENT,
+        self.MAX_FLUSH_TIMEOUT_SECS)
 
     # TODO(BEAM-4275): Add support for id_label and timestamp_attribute.
     if sink.id_label:
@@ -280,63 +449,125 @@ class _DirectWriteToPubSubFn(DoFn):
                                 'supported for PubSub writes')
 
   def start_bundle(self):
-    self._buffer = []
+    self._buffer = collections.deque()
+    # Bound once per bundle, as process() is called for every element.
+    self._append = self._buffer.append
+    self._pub_client = _get_publisher_client(
+        min(self.buffer_size, self.MAX_BATCH_MESSAGES),
+        self.MAX_BATCH_BYTES,
+        self.MAX_BATCH_LATENCY_SECS)
+    self._topic = self._pub_client.topic_path(self.project,
+                                              self.short_topic_name)
 
   def process(self, elem):
-    self._buffer.append(elem)
-    if len(self._buffer) >= self.BUFFER_SIZE_ELEMENTS:
+    self._append(elem)
+    if len(self._buffer) >= self.buffer_size:
       self._flush()
 
   def finish_bundle(self):
     self._flush()
 
   def _flush(self):
-    from google.cloud import pubsub
-    pub_client = pubsub.PublisherClient()
-    topic = pub_client.topic_path(self.project, self.short_topic_name)
+    pub_client = self._pub_client
+    topic = self._topic
+    deadline = time.time() + self.flush_timeout_secs
 
+    # Publish the buffered elements with a bounded number of messages in
+    # flight, so that the futures of completed messages can be released while
+    # the rest of the buffer is still being published.
     if self.with_attributes:
-      futures = [pub_client.publish(topic, elem.data, **elem.attributes)
-                 for elem in self._buffer]
+      def publish(elem):
+        return pub_client.publish(topic, elem.data, **elem.attributes)
     else:
-      futures = [pub_client.publish(topic, elem)
-                 for elem in self._buffer]
-
-    timer_start = time.time()
-    for future in futures:
-      remaining = self.FLUSH_TIMEOUT_SECS - (time.time() - timer_start)
-      future.result(remaining)
-    self._buffer = []
-
-
-def _get_pubsub_transform_overrides(pipeline_options):
+      def publish(elem):
+        return pub_client.publish(topic, elem)
+
+    # Futures of older PubSub client libraries are not concurrent.futures
+    # Futures and cannot be passed to concurrent.futures.wait(). They are
+    # waited for with result() in publish order instead.
+    pending = set()
+    pending_in_order = collections.deque()
+    for elem in self._buffer:
+      if len(pending) + len(pending_in_order) >= self.MAX_IN_FLIGHT_MESSAGES:
+        if pending_in_order:
+          self._wait_for_publish(pending_in_order.popleft(), deadline)
+        else:
+          pending = self._wait_for_publishes(pending, deadline)
+      future = publish(elem)
+      if isinstance(future, concurrent.futures.Future):
+        pending.add(future)
+      else:
+        pending_in_order.append(future)
+
+    for future in pending_in_order:
+      self._wait_for_publish(future, deadline)
+    # Check the remaining publishes in the order they complete, so that a
+    # failure is reported as soon as it happens.
+    for future in concurrent.futures.as_completed(
+        pending, timeout=max(0, deadline - time.time())):
+      future.result()
+    self._buffer.clear()
+
+  def _wait_for_publish(self, future, deadline):
+    """Waits for the given publish future until the flush deadline."""
+    future.result(timeout=max(0, deadline - time.time()))
+
+  def _wait_for_publishes(self, futures, deadline):
+    """Waits for any of the given publish futures and returns those not done.
+
+    Raises the first publish error encountered, or a TimeoutError if none of
+    the futures completes before the flush deadline.
+    """
+    done, not_done = concurrent.futures.wait(
+        futures,
+        timeout=max(0, deadline - time.time()),
+        return_when=concurrent.futures.FIRST_COMPLETED)
+    if not done:
+      raise concurrent.futures.TimeoutError(
+          'Timed out after %s seconds waiting for %d PubSub messages to be '
+          'published.' % (self.flush_timeout_secs, len(not_done)))
+    for future in done:
+      future.result()
+    return not_done
+
+
+def _get_pubsub_transform_overrides(streaming, buffer_size):
   from apache_beam.io.gcp import pubsub as beam_pubsub
   from apache_beam.pipeline import PTransformOverride
 
   class ReadFromPubSubOverride(PTransformOverride):
+    def __init__(self, streaming):
+      self.streaming = streaming
+
     def matches(self, applied_ptransform):
       return isinstance(applied_ptransform.transform,
                         beam_pubsub.ReadFromPubSub)
 
     def get_replacement_transform(self, transform):
-      if not pipeline_options.view_as(StandardOptions).streaming:
+      if not self.streaming:
         raise Exception('PubSub I/O is only available in streaming mode '
                         '(use the --streaming flag).')
       return _DirectReadFromPubSub(transform._source)
 
   class WriteToPubSubOverride(PTransformOverride):
+    def __init__(self, streaming, buffer_size):
+      self.streaming = streaming
+      self.buffer_size = buffer_size
+
     def matches(self, applied_ptransform):
       return isinstance(
           applied_ptransform.transform,
           (beam_pubsub.WriteToPubSub, beam_pubsub._WriteStringsToPubSub))
 
     def get_replacement_transform(self, transform):
-      if not pipeline_options.view_as(StandardOptions).streaming:
+      if not self.streaming:
         raise Exception('PubSub I/O is only available in streaming mode '
                         '(use the --streaming flag).')
-      return beam.ParDo(_DirectWriteToPubSubFn(transform._sink))
+      return beam.ParDo(_DirectWriteToPubSubFn(transform._sink,
+                                               self.buffer_size))
 
-  return [ReadFromPubSubOverride(), WriteToPubSubOverride()]
+  return [ReadFromPubSubOverride(streaming),
+          WriteToPubSubOverride(streaming, buffer_size)]
 
 
 class BundleBasedDirectRunner(PipelineRunner):
@@ -364,7 +595,6 @@ class BundleBasedDirectRunner(PipelineRunner):
     # Performing configured PTransform overrides.
     pipeline.replace_all(_get_transform_overrides(options))
 
-    # If the TestStream I/O is used, use a mock test clock.
     class _TestStreamUsageVisitor(PipelineVisitor):
       """Visitor determining whether a Pipeline uses a TestStream."""
 
@@ -375,13 +605,37 @@ class BundleBasedDirectRunner(PipelineRunner):
         if isinstance(applied_ptransform.transform, _TestStream):
           self.uses_test_stream = True
 
-    visitor = _TestStreamUsageVisitor()
-    pipeline.visit(visitor)
-    clock = TestClock() if visitor.uses_test_stream else RealClock()
+    class _CompositeVisitor(PipelineVisitor):
+      """Visitor forwarding each callback to all of the given visitors, so
+      that they are all run in a single traversal of the Pipeline."""
+
+      def __init__(self, visitors):
+        self.visitors = visitors
+
+      def visit_value(self, value, producer_node):
+        for visitor in self.visitors:
+          visitor.visit_value(value, producer_node)
+
+      def visit_transform(self, transform_node):
+        for visitor in self.visitors:
+          visitor.visit_transform(transform_node)
+
+      def enter_composite_transform(self, transform_node):
+        for visitor in self.visitors:
+          visitor.enter_composite_transform(transform_node)
+
+      def leave_composite_transform(self, transform_node):
+        for visitor in self.visitors:
+          visitor.leave_composite_transform(transform_node)
 
     _LOGGER.info('Running pipeline with DirectRunner.')
     self.consumer_tracking_visitor = ConsumerTrackingPipelineVisitor()
-    pipeline.visit(self.consumer_tracking_visitor)
+    test_stream_visitor = _TestStreamUsageVisitor()
+    pipeline.visit(_CompositeVisitor(
+        [self.consumer_tracking_visitor, test_stream_visitor]))
+
+    # If the TestStream I/O is used, use a mock test clock.
+    clock = TestClock() if test_stream_visitor.uses_test_stream else RealClock()
 
     evaluation_context = EvaluationContext(
         options,
@@ -411,23 +665,45 @@ class BundleBasedDirectRunner(PipelineRunner):
 DirectRunner = SwitchingDirectRunner
 
 
+# Weak references to the DirectPipelineResults that have not been garbage
+# collected yet. They are kept alive here so that their callbacks run.
+_RESULT_REFS = set()
+
+
+def _on_result_collected(result_ref, state_holder):
+  _RESULT_REFS.discard(result_ref)
+  if state_holder[0] == PipelineState.RUNNING:
+    _LOGGER.warning(
+        'The DirectPipelineResult is being garbage-collected while the '
+        'DirectRunner is still running the corresponding pipeline. This may '
+        'lead to incomplete execution of the pipeline if the main thread '
+        'exits before pipeline completion. Consider using '
+        'result.wait_until_finish() to wait for completion of pipeline '
+        'execution.')
+
+
 class DirectPipelineResult(PipelineResult):
   """A DirectPipelineResult provides access to info about a pipeline."""
 
   def __init__(self, executor, evaluation_context):
+    # The state is kept in a holder shared with the weakref callback, which
+    # warns if the result is collected while the pipeline is still running.
+    # Unlike __del__, this does not keep the result from being collected
+    # when it is part of a reference cycle.
+    state_holder = self._state_holder = [None]
     super(DirectPipelineResult, self).__init__(PipelineState.RUNNING)
     self._executor = executor
     self._evaluation_context = evaluation_context
+    _RESULT_REFS.add(weakref.ref(
+        self, lambda ref: _on_result_collected(ref, state_holder)))
+
+  @property
+  def _state(self):
+    return self._state_holder[0]
 
-  def __del__(self):
-    if self._state == PipelineState.RUNNING:
-      _LOGGER.warning(
-          'The DirectPipelineResult is being garbage-collected while the '
-          'DirectRunner is still running the corresponding pipeline. This may '
-          'lead to incomplete execution of the pipeline if the main thread '
-          'exits before pipeline completion. Consider using '
-          'result.wait_until_finish() to wait for completion of pipeline '
-          'execution.')
+  @_state.setter
+  def _state(self, state):
+    self._state_holder[0] = state
 
   def wait_until_finish(self, duration=None):
     if not PipelineState.is_terminal(self.state):
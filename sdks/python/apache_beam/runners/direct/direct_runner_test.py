@@ -17,11 +17,13 @@
 
 from __future__ import absolute_import
 
+import gc
 import threading
 import unittest
 from collections import defaultdict
 
 import hamcrest as hc
+import mock
 
 import apache_beam as beam
 from apache_beam.metrics.cells import DistributionData
@@ -34,10 +36,16 @@ from apache_beam.pipeline import Pipeline
 from apache_beam.runners import DirectRunner
 from apache_beam.runners import TestDirectRunner
 from apache_beam.runners import create_runner
+from apache_beam.runners.dataflow.native_io.iobase import NativeSink
+from apache_beam.runners.dataflow.native_io.iobase import NativeSource
+from apache_beam.runners.direct import direct_runner
+from apache_beam.runners.direct.direct_runner import DirectPipelineResult
 from apache_beam.runners.direct.evaluation_context import _ExecutionContext
 from apache_beam.runners.direct.transform_evaluator import _GroupByKeyOnlyEvaluator
 from apache_beam.runners.direct.transform_evaluator import _TransformEvaluator
+from apache_beam.runners.runner import PipelineState
 from apache_beam.testing import test_pipeline
+from apache_beam.testing.test_stream import TestStream
 from apache_beam.testing.util import assert_that
 from apache_beam.testing.util import equal_to
 
@@ -116,6 +124,22 @@ class DirectPipelineResultTest(unittest.TestCase):
     hc.assert_that(gauge_result.committed.value, hc.equal_to(5))
     hc.assert_that(gauge_result.attempted.value, hc.equal_to(5))
 
+  def test_dropping_running_result_logs_warning(self):
+    result = DirectPipelineResult(mock.Mock(), mock.Mock())
+    self.assertEqual(PipelineState.RUNNING, result.state)
+    with mock.patch.object(direct_runner._LOGGER, 'warning') as warning:
+      del result
+      gc.collect()
+    self.assertEqual(1, warning.call_count)
+
+  def test_dropping_finished_result_logs_no_warning(self):
+    result = DirectPipelineResult(mock.Mock(), mock.Mock())
+    self.assertEqual(PipelineState.DONE, result.wait_until_finish())
+    with mock.patch.object(direct_runner._LOGGER, 'warning') as warning:
+      del result
+      gc.collect()
+    self.assertEqual(0, warning.call_count)
+
   def test_create_runner(self):
     self.assertTrue(
         isinstance(create_runner('DirectRunner'),
@@ -125,6 +149,64 @@ class DirectPipelineResultTest(unittest.TestCase):
                    TestDirectRunner))
 
 
+class FakeNativeSource(NativeSource):
+  """Fake native source. Does not work at runtime."""
+
+  def reader(self):
+    return None
+
+
+class FakeNativeSink(NativeSink):
+  """Fake native sink. Does not work at runtime."""
+
+  def writer(self):
+    return None
+
+
+class SwitchingDirectRunnerTest(unittest.TestCase):
+
+  def _selected_runner(self, pipeline):
+    """Runs the pipeline and returns the name of the runner it was run on."""
+    with mock.patch('apache_beam.runners.direct.direct_runner.'
+                    'BundleBasedDirectRunner.run_pipeline') as bundle_based, \
+         mock.patch('apache_beam.runners.portability.fn_api_runner.'
+                    'FnApiRunner.run_pipeline') as fnapi:
+      pipeline.run()
+    self.assertEqual(1, bundle_based.call_count + fnapi.call_count)
+    return 'FnApiRunner' if fnapi.called else 'BundleBasedDirectRunner'
+
+  def test_batch_pipeline_uses_fnapi_runner(self):
+    p = Pipeline(DirectRunner())
+    _ = (p
+         | beam.Create([('a', [1, 2])])
+         | beam.CombineValues(sum))
+    self.assertEqual('FnApiRunner', self._selected_runner(p))
+
+  def test_test_stream_uses_bundle_based_runner(self):
+    p = Pipeline(DirectRunner())
+    _ = p | TestStream().add_elements([1, 2, 3])
+    self.assertEqual('BundleBasedDirectRunner', self._selected_runner(p))
+
+  def test_native_source_uses_bundle_based_runner(self):
+    p = Pipeline(DirectRunner())
+    _ = p | beam.io.Read(FakeNativeSource())
+    self.assertEqual('BundleBasedDirectRunner', self._selected_runner(p))
+
+  def test_native_write_uses_bundle_based_runner(self):
+    p = Pipeline(DirectRunner())
+    _ = p | beam.Create([1, 2, 3]) | beam.io.Write(FakeNativeSink())
+    self.assertEqual('BundleBasedDirectRunner', self._selected_runner(p))
+
+  def test_combine_values_side_input_uses_bundle_based_runner(self):
+    p = Pipeline(DirectRunner())
+    offset = p | 'Offset' >> beam.Create([10])
+    _ = (p
+         | beam.Create([('a', [1, 2])])
+         | beam.CombineValues(lambda values, extra: sum(values) + extra,
+                              beam.pvalue.AsSingleton(offset)))
+    self.assertEqual('BundleBasedDirectRunner', self._selected_runner(p))
+
+
 class BundleBasedRunnerTest(unittest.TestCase):
   def test_type_hints(self):
     with test_pipeline.TestPipeline(runner='BundleBasedDirectRunner') as p: